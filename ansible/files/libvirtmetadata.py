@@ -6,10 +6,25 @@ Connection to libvirt and export of metadata.
 Includes VM info held by libvirt and statistics.
 
 """
+import atexit
+import io
 import re
-import uuid
-import xml.etree.ElementTree as ET
 from contextlib import contextmanager
+from time import monotonic
+
+try:
+    from lxml import etree as ET
+    XML_PARSER = ET.XMLParser(
+        huge_tree=False, remove_blank_text=True, resolve_entities=False)
+    _fromstring = ET.fromstring
+except Exception:
+    import xml.etree.ElementTree as ET
+    XML_PARSER = None
+    try:
+        # Entity-safe wrapper over the C-accelerated ElementTree
+        from defusedxml.ElementTree import fromstring as _fromstring
+    except Exception:
+        _fromstring = ET.fromstring
 
 try:
     import libvirt
@@ -22,6 +37,17 @@ except Exception:
     NOVA_NS = "http://openstack.org/xmlns/libvirt/nova/1.1"
 
 
+UUID_PATTERN = re.compile(
+    '[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}', re.I)
+
+
+def parse_xml(xml_string):
+    """Parse XML string with lxml when available, stdlib otherwise."""
+    if XML_PARSER is not None:
+        return _fromstring(xml_string, XML_PARSER)
+    return _fromstring(xml_string)
+
+
 class LibvirtMetadata:
     """
     Libvirt metadata
@@ -30,55 +56,91 @@ class LibvirtMetadata:
     Class is intended to be shared between exporters for compute nodes.
     """
 
+    META_TTL = 600  # seconds to trust cached instance metadata
+
     def __init__(self, xmlns=NOVA_NS):
-        self.uuidp = re.compile(
-            '[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}', re.I)
         self.STATS = 0
         self.FLAGS = libvirt.VIR_CONNECT_GET_ALL_DOMAINS_STATS_RUNNING
         self.LIBVIRT_INSTANCES = {}
         self.xmlns = xmlns
         self.status = -1  # uninitialized
+        self._meta_cache = {}
+        self._label_cache = {}
+        self._conn = None
+        atexit.register(self._close_connection)
+
+    def _open_connection(self):
+        """Return cached readonly connection, reopening when dead."""
+        if self._conn is not None:
+            try:
+                if self._conn.isAlive():
+                    return self._conn
+            except libvirt.libvirtError:
+                pass
+            self._close_connection()
+        self._conn = libvirt.openReadOnly(None)
+        return self._conn
+
+    def _close_connection(self):
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except Exception:
+                pass
+            self._conn = None
 
     @contextmanager
     def libvirt_connection(self):
-        """Yield readonly connection to libvirt."""
+        """Yield readonly connection to libvirt.
+
+        Connection is kept open between calls to avoid the socket
+        handshake on every scrape and closed on process exit.
+        """
         try:
-            conn = libvirt.openReadOnly(None)
-            try:
-                if conn:
-                    yield conn
-                    self.status = 0  # connected
-            finally:
-                conn.close()
+            conn = self._open_connection()
+            if conn:
+                yield conn
+                self.status = 0  # connected
         except libvirt.libvirtError:
+            self._close_connection()
             self.status = 1  # error
 
     def _load_xml_tree(self, tree):
         """
         Load XML tree into dict.
 
+        Walks the tree iteratively (post-order) instead of recursing,
+        avoiding a Python frame per element and recursion limits on
+        deep metadata trees.
+
         :param tree: libvirt XML tree (xml.etree.ElementTree),
 
         :return dict: parsed data
         """
-        data = {}
-        if tree.keys():
-            data = dict(tree.items())
-        if hasattr(tree, 'iter') and len(tree):
-            for item in tree.iter():
-                if item != tree:
-                    data[item.tag] = self._load_xml_tree(item)
-        elif hasattr(tree, 'getchildren') and tree.getchildren():
-            for item in tree.getchildren():
-                data[item.tag] = self._load_xml_tree(item)
-        elif tree.text and tree.text.strip():
-            if data:
-                data['value'] = tree.text
-            else:
-                return tree.text
-        return data if data else ''
-
-    def retrieve_domain_metadata(self, domain):
+        parsed = {}
+        stack = [tree]
+        order = []
+        while stack:
+            node = stack.pop()
+            order.append(node)
+            stack.extend(node)
+        for node in reversed(order):
+            if not len(node) and not node.attrib:
+                # Fast path: text-only leaf, the common shape in
+                # nova metadata trees
+                text = node.text
+                parsed[id(node)] = text if text and text.strip() else ''
+                continue
+            data = dict(node.attrib)
+            if len(node):
+                for item in node:
+                    data[item.tag] = parsed.pop(id(item))
+            elif node.text and node.text.strip():
+                data['value'] = node.text
+            parsed[id(node)] = data if data else ''
+        return parsed[id(tree)]
+
+    def retrieve_domain_metadata(self, domain, xml_string=None):
         """
         Retrieve domain metadata from libvirt domain.
 
@@ -92,33 +154,49 @@ class LibvirtMetadata:
 
         """
         data = {}
-        try:
-            xml_string = domain.metadata(2, self.xmlns)
-        except libvirt.libvirtError:
+        if xml_string is None:
+            xml_string = self._domain_metadata_xml(domain)
+        if not xml_string:
             return data
         try:
-            tree = ET.fromstring(xml_string)
+            tree = parse_xml(xml_string)
             data = self._load_xml_tree(tree)
         except Exception:
             pass
         return data
 
+    def _domain_metadata_xml(self, domain):
+        """Fetch raw metadata XML of domain, empty string when missing."""
+        try:
+            return domain.metadata(2, self.xmlns)
+        except libvirt.libvirtError:
+            return ''
+
     def load_instance_metadata(self, domain):
         """
         Load instance metadata data using libvirt domain.
 
         Returns dict of metadata for domain (domain name, uuid, nova name, project name).
+        Parsed metadata is memoized per instance uuid and only refreshed
+        when the metadata XML changes or the TTL expires.
         """
         metadata = {}
         try:
+            instance_uuid = domain.UUIDString()
+            xml_string = self._domain_metadata_xml(domain)
+            cached = self._meta_cache.get(instance_uuid)
+            if cached and cached[0] == xml_string and (
+                    monotonic() - cached[1]) < self.META_TTL:
+                return cached[2]
             metadata = {
                 'domain': domain.name(),
-                'uuid': str(uuid.UUID(bytes=domain.UUID()))
+                'uuid': instance_uuid
             }
-            data = self.retrieve_domain_metadata(domain)
+            data = self.retrieve_domain_metadata(domain, xml_string=xml_string)
             metadata['name'] = data.get('name', 'unknown')
             metadata['project'] = data.get('owner', {}).get(
                 'project', {}).get('value', 'unknown')
+            self._meta_cache[instance_uuid] = (xml_string, monotonic(), metadata)
         except Exception:
             pass
         return metadata
@@ -133,6 +211,32 @@ class LibvirtMetadata:
             self.load_libvirt_metadata()
         return self.LIBVIRT_INSTANCES
 
+    def _scrape_domains(self, conn):
+        """
+        Fused pass over all running domains.
+
+        One batched RPC fetches the domain handles; instance metadata
+        is loaded once per domain, LIBVIRT_INSTANCES is refreshed in
+        the same walk, and (domain, metadata) pairs are yielded so
+        callers can extract more data without a second pass.
+        """
+        seen = set()
+        for domain, _stats in conn.getAllDomainStats(self.STATS, self.FLAGS):
+            try:
+                metadata = self.load_instance_metadata(domain)
+            except Exception:
+                metadata = {}
+            if metadata.get('domain'):
+                self.LIBVIRT_INSTANCES[metadata['domain']] = metadata
+            if metadata.get('uuid'):
+                seen.add(metadata['uuid'])
+            yield domain, metadata
+        # Drop cached metadata of domains that no longer run so the
+        # cache does not grow for the life of the process
+        for uuid in list(self._meta_cache):
+            if uuid not in seen:
+                del self._meta_cache[uuid]
+
     def load_libvirt_metadata(self):
         """
         Load metadata and update the store.
@@ -140,10 +244,8 @@ class LibvirtMetadata:
         (Re)Loads global store of metadata.
         """
         with self.libvirt_connection() as conn:
-            for domain in conn.listAllDomains():
-                instance = domain.name()
-                self.LIBVIRT_INSTANCES[instance] = self.load_instance_metadata(
-                    domain)
+            for _domain, _metadata in self._scrape_domains(conn):
+                pass
 
     def get_instance_metadata(self, instance, domain=None):
         """Get instance metadata."""
@@ -160,6 +262,8 @@ class LibvirtMetadata:
 
     def load_image_metadata(self, metadata, disk):
         source = disk.find('source')
+        if source is None or source.get('protocol') != 'rbd':
+            return {}
         auth = disk.find('auth')
         driver = disk.find('driver')
         target = disk.find('target')
@@ -171,19 +275,19 @@ class LibvirtMetadata:
             volume = volume.replace('_disk', '').replace('volume-', '')
         except Exception:
             pass
-        try:
-            if volume:
-                volume = self.uuidp.findall(volume)[0]
-        except Exception:
-            if not volume:
-                volume = source.get('name', 'unknown')
-            if not pool:
-                pool = 'unknown'
+        if volume:
+            match = UUID_PATTERN.search(volume)
+            if match:
+                volume = match.group(0)
+        else:
+            volume = source.get('name', 'unknown')
+        if not pool:
+            pool = 'unknown'
         try:
             hosts = [
                 '{}:{}'.format(
                     host.get('name', ''), host.get('port', '')
-                ) for host in source.getchildren() if host.get('name') and host.get('port')
+                ) for host in source.findall('host') if host.get('name') and host.get('port')
             ]
         except Exception:
             hosts = []
@@ -206,23 +310,25 @@ class LibvirtMetadata:
     def get_rbd_metadata(self):
         rbd_images = []
         with self.libvirt_connection() as conn:
-            for domain in conn.listAllDomains():
+            for domain, metadata in self._scrape_domains(conn):
                 try:
-                    metadata = self.load_instance_metadata(domain)
+                    # Stream the domain XML instead of building the full tree,
+                    # clearing each disk element once processed.
+                    events = ET.iterparse(
+                        io.BytesIO(domain.XMLDesc().encode()), events=('end',))
+                    for _event, disk in events:
+                        # Only network disks can be RBD backed
+                        if disk.tag != 'disk' or disk.get('type') != 'network':
+                            continue
+                        try:
+                            image = self.load_image_metadata(metadata, disk)
+                            if image and image['volume']:
+                                rbd_images.append(image)
+                        except Exception:
+                            pass
+                        disk.clear()
                 except Exception:
-                    metadata = {}
-                try:
-                    domain_config = ET.fromstring(domain.XMLDesc())
-                    disks = domain_config.findall('.//disk')
-                except Exception:
-                    disks = []
-                for disk in disks:
-                    try:
-                        image = self.load_image_metadata(metadata, disk)
-                        if image['volume'] and image['protocol'] == 'rbd':
-                            rbd_images.append(image)
-                    except Exception:
-                        pass
+                    pass
 
         return rbd_images
 
@@ -237,23 +343,27 @@ class LibvirtMetadata:
             metadata['domain'] = instance
         if not isinstance(prefix, str):
             prefix = ''
+        # Prefixed metric names computed once per distinct item
+        prefixed = {}
 
         # Extra variable items and format them (additional metadata)
-        if 'variable' in stats_items:
-            var_data = stats_items.pop('variable')
+        # read without pop to keep the caller's dict intact
+        var_data = stats_items.get('variable')
+        if var_data:
             try:
                 for metaname, data in var_data.items():
                     splitter = ':' if ':' in metaname else '='
                     submeta = dict([(*x.split(splitter),)
                                     for x in metaname.split(',')])
-                    for key, value in metadata.items():
-                        submeta[key] = value
+                    submeta.update(metadata)
                     var_keys = sorted(submeta.keys())
                     var_items = [submeta[x] for x in var_keys]
                     for item, value in data.items():
                         # Formatting stats
-                        stats.append(['{}{}'.format(prefix, item),
-                                      var_keys, var_items, value])
+                        name = prefixed.get(item)
+                        if name is None:
+                            name = prefixed[item] = prefix + item
+                        stats.append((name, var_keys, var_items, value))
             except Exception:
                 pass
 
@@ -261,15 +371,19 @@ class LibvirtMetadata:
         var_keys = sorted(metadata.keys())
         var_items = [metadata[x] for x in var_keys]
         for item, value in stats_items.items():
-            stats.append(['{}{}'.format(prefix, item),
-                          var_keys, var_items, value])
+            if item == 'variable':
+                continue
+            name = prefixed.get(item)
+            if name is None:
+                name = prefixed[item] = prefix + item
+            stats.append((name, var_keys, var_items, value))
         return stats
 
     def export_prom_stats(self, stats_items, instance, metadata=None, domain=None, prefix='libv_'):
         """Export stats in prometheus format."""
-        stats = ''
         if not stats_items or not isinstance(stats_items, dict):
-            return stats
+            return ''
+        parts = []
 
         if not metadata or not isinstance(metadata, dict):
             metadata = self.get_instance_metadata(instance, domain=domain)
@@ -277,12 +391,30 @@ class LibvirtMetadata:
             metadata['domain'] = instance
         if not isinstance(prefix, str):
             prefix = ''
-        metadata = ['{}="{}"'.format(key, metadata[key])
-                    for key in sorted(metadata.keys())]
+        # Label formatting is cached since metadata rarely changes
+        # between scrapes of the same instance
+        cache_key = None
+        try:
+            cache_key = (instance, tuple(sorted(metadata.items())))
+            hash(cache_key)
+        except TypeError:
+            cache_key = None  # unhashable metadata values cannot be cached
+        cached = self._label_cache.get(cache_key) if cache_key else None
+        if cached:
+            metadata, metalabel = cached
+        else:
+            metadata = ['{}="{}"'.format(key, metadata[key])
+                        for key in sorted(metadata.keys())]
+            metalabel = '{}{}{}'.format('{', ','.join(metadata), '}')
+            if cache_key:
+                if len(self._label_cache) > 1024:
+                    self._label_cache.clear()
+                self._label_cache[cache_key] = (metadata, metalabel)
 
         # Extra variable items and format them (additional metadata)
-        if 'variable' in stats_items:
-            var_data = stats_items.pop('variable')
+        # read without pop to keep the caller's dict intact
+        var_data = stats_items.get('variable')
+        if var_data:
             try:
                 for metaname, data in var_data.items():
                     if ':' in metaname:
@@ -291,17 +423,18 @@ class LibvirtMetadata:
                             *mn.split(':')) for mn in metanames]
                     else:
                         metaitems = [metaname]
-                    metalabel = '{}{}{}'.format(
+                    varlabel = '{}{}{}'.format(
                         '{', ','.join(metadata + metaitems), '}')
                     for item, value in data.items():
                         # Formatting stats
-                        stats += '{}{}{} {}\n'.format(prefix,
-                                                      item, metalabel, value)
+                        parts.append('{}{}{} {}\n'.format(
+                            prefix, item, varlabel, value))
             except Exception:
                 pass
 
         # Formatting stats
-        metalabel = '{}{}{}'.format('{', ','.join(metadata), '}')
         for item, value in stats_items.items():
-            stats += '{}{}{} {}\n'.format(prefix, item, metalabel, value)
-        return stats
+            if item == 'variable':
+                continue
+            parts.append('{}{}{} {}\n'.format(prefix, item, metalabel, value))
+        return ''.join(parts)
@@ -22,14 +22,20 @@ Heartbeat print is run every 2 seconds.
 import asyncio
 import concurrent.futures
 import functools
+import itertools
 import signal
 import sys
 import traceback
-import uuid
 from datetime import datetime
 from datetime import timedelta
 
 
+@functools.lru_cache(maxsize=32)
+def _period_delta(unit, round):
+    """Period length in seconds for a (unit, round) combination."""
+    return int(timedelta(**{'{}s'.format(unit): round}).total_seconds())
+
+
 class Scheduler:
     """
     Task scheduler.
@@ -48,6 +54,8 @@ class Scheduler:
         self.__executor = concurrent.futures.ThreadPoolExecutor(
             max_workers=max_workers)
         self.__tasks = []
+        # Sequence for log-only task identifiers
+        self.__task_seq = itertools.count()
         self.exception_caught = False
         self.debug = False
 
@@ -96,7 +104,6 @@ class Scheduler:
                                     E.g. expect task to run every day, 5h after midnight
                                     periodic_delay={'hours': 5} and unit='day'
         """
-        loop = asyncio.get_event_loop()
         loglevel = 'INFO' if unit == 'day' else 'DEBUG'
         async_sleep = self.__async_sleep if unit in [
             'second', 'minute', 'hour'] else self.__async_hard_sleep
@@ -104,18 +111,40 @@ class Scheduler:
         next_run, delay = (
             datetime.now().replace(microsecond=0), 0
         ) if run_now else self.__get_wait_time(unit, round, periodic_delay)
+        # A run_now anchor is not on the period grid and must not be
+        # stepped forward by whole periods
+        aligned = not run_now
         run_now = False  # Hard reset to avoid looping tasks
+        period_seconds = _period_delta(unit, round)
 
         while True:
             # Schedule the task
-            task_id = 'period:{}:{}'.format(task.__name__, uuid.uuid4())
+            task_id = 'period:{}:{}'.format(
+                task.__name__, next(self.__task_seq))
             self.log('{} - task scheduled at: {}'.format(task_id,
                                                          next_run), loglevel, source='TASK')
-            loop.call_later(delay, self.__callback, executor,
-                            task, task_id, next_run, args)
+            self.loop.call_later(delay, self.__callback, executor,
+                                 task, task_id, next_run, args)
             # Wait the same period before scheduling next run
             await async_sleep(next_run, delay)
-            next_run, delay = self.__get_wait_time(unit, round, periodic_delay)
+            if periodic_delay:
+                # Delay may hold callables resolved in each period
+                next_run, delay = self.__get_wait_time(
+                    unit, round, periodic_delay)
+            elif not aligned:
+                # Realign to the period boundary after a run_now start
+                next_run, delay = self.__get_wait_time(
+                    unit, round, periodic_delay)
+                aligned = True
+            else:
+                # Fast path: step along the period grid without
+                # recomputing the rounding every tick
+                next_run = next_run + timedelta(seconds=period_seconds)
+                delay = (next_run - datetime.now()).total_seconds()
+                if delay < 0:
+                    # Re-anchor after drift (suspend, slow callback)
+                    next_run, delay = self.__get_wait_time(
+                        unit, round, periodic_delay)
 
     def add_delayed_task(self, task, unit='hour', run_now=False, delay=0, round=1, args=()):
         """
@@ -148,30 +177,27 @@ class Scheduler:
         :param int round: rounding unit windows (default every 1st hour)
         :param bool run_now: run the task without delay (in debug only, default: False)
         """
-        loop = asyncio.get_event_loop()
         # Compute time of next run and optimal delay to sleep
         next_run, delay = (datetime.now(), 0) if run_now else self.__get_wait_time(
             unit, round, delay)
-        task_id = 'delay:{}:{}'.format(task.__name__, uuid.uuid4())
+        task_id = 'delay:{}:{}'.format(task.__name__, next(self.__task_seq))
         self.log('{} - task scheduled at: {}'.format(task_id,
                                                      next_run), 'DEBUG', source='TASK')
-        loop.call_later(delay, self.__callback, executor,
-                        task, task_id, next_run, args)
+        self.loop.call_later(delay, self.__callback, executor,
+                             task, task_id, next_run, args)
 
     def __callback(self, executor, task, task_id, next_run, args):
         """Assign task to executor when called."""
         async def assign_to_executor(executor, task, next_run, args):
-            loop = asyncio.get_event_loop()
             await self.__async_sleep(next_run, 0)
-            if loop.is_running():
-                await loop.run_in_executor(executor, task, *args)
-        loop = asyncio.get_event_loop()
-        if loop.is_running():
+            if self.loop.is_running():
+                await self.loop.run_in_executor(executor, task, *args)
+        if self.loop.is_running():
             self.log('{} - task started'.format(task_id),
                      'DEBUG', source='TASK')
             future = asyncio.run_coroutine_threadsafe(
                 assign_to_executor(executor, task, next_run, args),
-                loop
+                self.loop
             )
             future.add_done_callback(functools.partial(
                 self.__handle_task_exception, task_id
@@ -190,7 +216,7 @@ class Scheduler:
         :return datetime: next nearest date-time based on the period
         """
         usedate = usedate if isinstance(usedate, datetime) else datetime.now()
-        delta = int(timedelta(**{'{}s'.format(unit): round}).total_seconds())
+        delta = _period_delta(unit, round)
         seconds = (usedate.replace(tzinfo=None) - usedate.min).seconds
         rounding = (seconds + delta) // delta * delta
         delay = delay if delay < delta else 0
@@ -199,11 +225,14 @@ class Scheduler:
     async def __async_sleep(self, next_run, delay):
         """
         Sleep and assure next run period.
+
+        Computes the remaining time once and waits in a single
+        scheduled sleep instead of polling the clock.
         """
         await asyncio.sleep(delay)
-        while datetime.now() <= next_run:
-            # Assure next period window
-            await asyncio.sleep(0.2)
+        remaining = (next_run - datetime.now()).total_seconds()
+        if remaining > 0:
+            await asyncio.sleep(remaining)
 
     async def __async_hard_sleep(self, next_run, delay):
         """
@@ -15,13 +15,15 @@ TODO:
   * Use python guestfs and inspectOS
 """
 import argparse
-import csv
+import concurrent.futures
+import hashlib
+import json
 import os
+import shutil
+import socket
 import subprocess
 import sys
 import tempfile
-from random import randrange
-from time import sleep
 
 from prometheus_client import start_http_server
 from prometheus_client.core import REGISTRY
@@ -36,28 +38,46 @@ try:
 except Exception:
     scheduler = None
 
+# Concurrent virt-df subprocesses per collection cycle
+VIRTDF_WORKERS = 4
+# Parsed virt-df rows per image path, keyed to an rbd info
+# fingerprint so unchanged volumes are not re-scanned
+_VIRTDF_CACHE = {}
+
 
 class CustomCollector(object):
     def __init__(self, helper, helper_name='unknown', libv_meta=None):
         self.ALL_STATS = []
+        self._snapshot = []
         self.HELPER = helper
         self.HELPER_NAME = helper_name
         self.libv_meta = libv_meta
 
-    def collect(self):
-        items = {}
-
-        for stat in self.ALL_STATS:
-            if stat[0] not in items:
-                items[stat[0]] = []
-            items[stat[0]].append(stat[1:])
-
-        for key, values in items.items():
+    def update_stats(self, all_stats):
+        """
+        Publish new stats for collect.
+
+        The metric families are fully built here, once per collection
+        cycle, and swapped in with a single reference assignment
+        (atomic in CPython), so a scrape only replays the prepared
+        snapshot instead of regrouping and rebuilding gauges.
+        """
+        grouped = {}
+        for stat in all_stats:
+            grouped.setdefault(stat[0], []).append(stat[1:])
+        snapshot = []
+        for key, values in grouped.items():
             labels = values[0][0]
             g = GaugeMetricFamily(key, self.HELPER, labels=labels)
             for labels, metadata, value in values:
                 g.add_metric(metadata, value)
-            yield g
+            snapshot.append(g)
+        self._snapshot = snapshot
+        self.ALL_STATS = all_stats
+
+    def collect(self):
+        for gauge in self._snapshot:
+            yield gauge
 
         try:
             if self.libv_meta:
@@ -72,7 +92,117 @@ class CustomCollector(object):
             pass
 
 
-def get_virtfs_df_pervolume(libv_meta):
+def rbd_fingerprint(image):
+    """
+    Cheap change fingerprint for one RBD volume.
+
+    Returns (size, modify_timestamp) from rbd info, a
+    milliseconds probe compared to the multi-second libguestfs
+    appliance boot of virt-df. Returns None when the probe fails or
+    the cluster does not track modify timestamps; the volume is then
+    treated as changed and scanned as before.
+    """
+    for host in image.get('hosts', []):
+        if not isinstance(host, str):
+            continue
+        try:
+            probe = subprocess.run([
+                'rbd', 'info', '--format', 'json',
+                '--id', image['username'], '-m', host, image['path']
+            ], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                check=True, timeout=10)
+            info = json.loads(probe.stdout)
+        except Exception:
+            continue  # next monitor host
+        stamp = info.get('modify_timestamp')
+        if stamp:
+            return (info.get('size'), stamp)
+        return None
+    return None
+
+
+def run_virtdf(image, host, root_tmp):
+    """
+    Run virt-df for one image through one monitor host.
+
+    Directs stdout to a spooled temporary file so the child never
+    blocks on a full pipe buffer. virt-df --csv emits a fixed schema
+    without quoting or embedded delimiters, so the buffer is split
+    into byte rows directly instead of going through the csv state
+    machine; fields are decoded by the consumer only when needed.
+    Runs in a private subdirectory of the shared root_tmp so
+    concurrent workers do not collide while cleanup stays a single
+    rmtree per run.
+    """
+    tmpdir = tempfile.mkdtemp(dir=root_tmp)
+    try:
+        # Minimal explicit environment: PATH is for the tools virt-df
+        # spawns itself and LANG=C skips libguestfs locale
+        # initialization
+        env = {
+            'TMPDIR': tmpdir,
+            'PATH': '/usr/sbin:/usr/bin:/sbin:/bin',
+            'LANG': 'C',
+        }
+        with tempfile.SpooledTemporaryFile(
+                max_size=65536, mode='w+b', dir=tmpdir) as stdout_file:
+            # Absolute executable and close_fds=False let CPython use
+            # posix_spawn instead of fork+exec with an fd scan; fds
+            # are CLOEXEC by default so nothing leaks to the child
+            subprocess.run([  # killed after 60s - e.g. locked image
+                '/usr/bin/virt-df', '--csv', '-P', '1',
+                '--format={}'.format(image['format']),
+                '-a',
+                '{}://{}@{}/{}'.format(image['protocol'],
+                                       image['username'], host, image['path'])
+            ], stdout=stdout_file, env=env, check=True, timeout=60,
+                close_fds=False)
+            stdout_file.seek(0)
+            rows = [line.split(b',')
+                    for line in stdout_file.read().splitlines()]
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+    return rows
+
+
+def query_virtdf(image, root_tmp):
+    """
+    Retrieve virt-df data for one image.
+
+    Tries all monitor hosts in order and returns the parsed rows of
+    the first successful run, None when all hosts failed.
+    Results are cached per image path together with the rbd info
+    fingerprint of the volume, so the libguestfs appliance boot is
+    skipped on later scans while the volume has not been written to;
+    failures invalidate the cached entry.
+    """
+    path = image['path']
+    fingerprint = rbd_fingerprint(image)
+    cached = _VIRTDF_CACHE.get(path)
+    if cached and fingerprint and cached[0] == fingerprint:
+        return cached[1]
+    for host in image.get('hosts', []):
+        if not isinstance(host, str):
+            continue
+        try:
+            rows = run_virtdf(image, host, root_tmp)
+        except subprocess.CalledProcessError as e:
+            print('[ERROR] VIRT-DF Exit: {} ({})'.format(image['path'], str(e)))
+            continue  # if subprocess returns non-zero exit status
+        except subprocess.TimeoutExpired:
+            print('[ERROR] VIRT-DF Timeout: {}'.format(image['path']))
+            continue  # if timeout of subprocess - e.g. locked image
+        if rows is not None:
+            # First successful monitor host wins; cache only when the
+            # volume can be fingerprinted for change detection
+            if fingerprint:
+                _VIRTDF_CACHE[path] = (fingerprint, rows)
+            return rows
+    _VIRTDF_CACHE.pop(path, None)
+    return None
+
+
+def iter_virtfs_df_perdomain(libv_meta):
     """
     Time/resource consuming - needs to run per hour or nightly
     not for peak detection, but rather for information.
@@ -80,134 +210,160 @@ def get_virtfs_df_pervolume(libv_meta):
     Virt-df starts read-only micro-instances with mounts and exports
     df data (display free disk data).
     Virt-df uses kB as unit for blocks.
+    Subprocesses are fanned out over a bounded thread pool since the
+    wall time is dominated by the libguestfs appliance boot; results
+    are aggregated in a single thread and yielded per domain
+    (instance, stats, metadata) as soon as all images of the domain
+    have been processed, so callers can publish partial results
+    instead of waiting for the full scan.
     """
     try:
         rdb_data = libv_meta.get_rbd_metadata()
         data = {}
         metadata = {}
-        for image in rdb_data:
-            if image['format'] != 'raw':
-                continue
-            if any(not image.get(x) for x in [
-                'format', 'protocol', 'username', 'path', 'domain'
-            ]):
-                continue
+        images = []
+        # Filter first: domain entries are only allocated for images
+        # that can actually produce data. Images without monitor
+        # hosts previously left zeroed domains in the output.
+        valid_images = [
+            image for image in rdb_data
+            if image['format'] == 'raw' and image.get('hosts') and all(
+                image.get(x) for x in (
+                    'protocol', 'username', 'path', 'domain'))
+        ]
+        for image in valid_images:
+            # Bind the hot columns to locals once per image
+            domain = image['domain']
+            disk = image.get('device', 'unknown')
 
             # Prepare data structures
-            if image['domain'] not in metadata:
-                metadata[image['domain']] = {
-                    'domain': image['domain'],
+            if domain not in metadata:
+                metadata[domain] = {
+                    'domain': domain,
                     'name': image['name'],
                     'project': image['project'],
                     'uuid': image['uuid'],
                 }
 
-            if image['domain'] not in data:
-                data[image['domain']] = {'variable': {},
-                                         'storage_total': 0, 'storage_used': 0}
-
-            disk_device = 'disk={}'.format(image.get('device', 'unknown'))
-            disk_pool = 'pool={}'.format(image.get('pool', 'unknown'))
-            disk_volume = 'volume={}'.format(image.get('volume', 'unknown'))
-
-            device = ','.join([disk_device, disk_pool, disk_volume])
-            if device not in data[image['domain']]['variable']:
-                data[image['domain']]['variable'][device] = {
-                    'disk_total': 0, 'disk_used': 0}
-
-            # Try all monitor hosts or use break to go for different image
-            for host in image.get('hosts', []):
-                if not isinstance(host, str):
-                    continue
-
-                try:  # Subprocess to retrieve data
-                    with tempfile.TemporaryDirectory(prefix='virtfs-exporter-', dir='/tmp') as tmpdir:
-                        env = {'TMPDIR': tmpdir}
-                        response = subprocess.run([  # SIGINT after 60s SIGKILL after 90s
-                            'timeout', '--kill-after=90', '--signal=INT', '60', 'virt-df', '--csv', '-P', '1',
-                            '--format={}'.format(image['format']),
-                            '-a',
-                            '{}://{}@{}/{}'.format(image['protocol'],
-                                                   image['username'], host, image['path'])
-                        ], stdout=subprocess.PIPE, env=env, check=True)  # timeout=60 - taken to lock on one only
-                except PermissionError as e:
-                    print('[ERROR] VIRT-DF Failed to cleanup tmp: {}'.format(str(e)))
-                except subprocess.CalledProcessError as e:
-                    print(
-                        '[ERROR] VIRT-DF Exit: {} ({})'.format(image['path'], str(e)))
-                    continue  # if subprocess returns non-zero exit status
-                except subprocess.TimeoutExpired:
-                    print('[ERROR] VIRT-DF Timeout: {}'.format(image['path']))
-                    continue  # if timeout of subprocess - e.g. locked image
-
-                try:  # Load csv from stdout
-                    csv_file = response.stdout.decode(
-                        'utf-8').strip().split('\n')
-                    csv_reader = csv.DictReader(csv_file, delimiter=',')
-                except Exception:
-                    break  # try other image not other host
-
-                # Load CSV data received from current host
-                for row in csv_reader:
+            if domain not in data:
+                data[domain] = {'variable': {},
+                                'storage_total': 0, 'storage_used': 0}
+
+            # Label strings are constant per image - compute them once
+            disk_device = 'disk=' + disk
+            disk_pool = 'pool=' + image.get('pool', 'unknown')
+            disk_volume = 'volume=' + image.get('volume', 'unknown')
+            device = disk_device + ',' + disk_pool + ',' + disk_volume
+            part_prefix = disk.replace('vd', 'sd')
+
+            variable = data[domain]['variable']
+            if device not in variable:
+                variable[device] = {'disk_total': 0, 'disk_used': 0}
+            images.append(
+                (image, domain, device, disk_pool, disk_volume, part_prefix))
+
+        # Outstanding image count per domain to detect completion
+        remaining = {}
+        for item in images:
+            remaining[item[1]] = remaining.get(item[1], 0) + 1
+
+        # Fan out the expensive subprocesses, aggregate single-threaded
+        with tempfile.TemporaryDirectory(prefix='virtfs-exporter-', dir='/tmp') as root_tmp, \
+                concurrent.futures.ThreadPoolExecutor(max_workers=VIRTDF_WORKERS) as executor:
+            futures = {}
+            for item in images:
+                futures[executor.submit(query_virtdf, item[0], root_tmp)] = item
+            for future in concurrent.futures.as_completed(futures):
+                image, domain, device, disk_pool, disk_volume, part_prefix = futures[future]
+                try:
+                    rows = future.result()
+                except Exception as e:
+                    print('[ERROR] VIRT-DF Failed: {} ({})'.format(
+                        image['path'], str(e)))
+                    rows = None
+                if rows:
                     try:
-                        data[image['domain']
-                             ]['storage_total'] += int(row['1K-blocks'])
-                        data[image['domain']
-                             ]['storage_used'] += int(row['Used'])
+                        # Resolve column indices once from the header row
+                        header = rows[0]
+                        i_blk = header.index(b'1K-blocks')
+                        i_used = header.index(b'Used')
+                        i_fs = header.index(b'Filesystem')
                     except Exception:
-                        pass
-                    try:
-                        data[image['domain']
-                             ]['variable'][device]['disk_total'] += int(row['1K-blocks'])
-                        data[image['domain']
-                             ]['variable'][device]['disk_used'] += int(row['Used'])
-                    except Exception:
-                        pass
-                    try:
-                        part_prefix = image.get('device').replace('vd', 'sd')
+                        rows = None  # try other image
+                if rows:
+                    # Load CSV data received from current host
+                    max_index = max(i_blk, i_used, i_fs)
+                    dom_data = data[domain]
+                    variable = dom_data['variable']
+                    var_dev = variable[device]
+                    for row in rows[1:]:
+                        if len(row) <= max_index:
+                            continue  # malformed row
+                        # int() needs text, the numeric fields are tiny
+                        blk = row[i_blk].decode('ascii', 'ignore')
+                        used = row[i_used].decode('ascii', 'ignore')
+                        if blk.isdigit() and used.isdigit():
+                            blk_int = int(blk)
+                            used_int = int(used)
+                            dom_data['storage_total'] += blk_int
+                            dom_data['storage_used'] += used_int
+                            var_dev['disk_total'] += blk_int
+                            var_dev['disk_used'] += used_int
+                        # Filesystem column is only decoded here
                         part_code = os.path.split(
-                            row['Filesystem'])[-1].replace(part_prefix, '').replace('sda', '')
-                        try:
-                            if part_code:
-                                part_code = int(part_code)
-                        except Exception:
-                            pass
+                            row[i_fs].decode('utf-8', 'replace')
+                        )[-1].replace(part_prefix, '').replace('sda', '')
+                        if part_code.isdigit():
+                            part_code = int(part_code)
                         disk_partition = 'partition={}{}'.format(
                             part_prefix, part_code)
                         partition = ','.join(
                             [disk_partition, disk_pool, disk_volume])
-                        data[image['domain']]['variable'][partition] = {
-                            'partition_total': row['1K-blocks'],
-                            'partition_used': row['Used'],
+                        variable[partition] = {
+                            'partition_total': blk,
+                            'partition_used': used,
                         }
-                    except Exception:
-                        pass
-                # If succesfully stored data using monitor host
-                # break the hosts and go to next image
-                break
-
-        return data, metadata
+                # Hand over the domain once its last image finished
+                remaining[domain] -= 1
+                if not remaining[domain]:
+                    yield domain, data[domain], metadata[domain]
     except Exception as e:
         print('[ERROR] Failed collecting disk data: {}'.format(str(e)))
-    return {}
+        raise
+
+
+def get_virtfs_df_pervolume(libv_meta):
+    """
+    Collect virt-df data for all domains at once.
+
+    Compatibility wrapper around iter_virtfs_df_perdomain returning
+    the (data, metadata) dicts of the complete scan.
+    """
+    data = {}
+    metadata = {}
+    for instance, stats, meta in iter_virtfs_df_perdomain(libv_meta):
+        data[instance] = stats
+        metadata[instance] = meta
+    return data, metadata
 
 
 def stats_disks(libv_meta, cc):
     all_stats = []
 
     try:
-        dsk_stats, metadata = get_virtfs_df_pervolume(libv_meta)
-        for instance, stats in dsk_stats.items():
+        for instance, stats, meta in iter_virtfs_df_perdomain(libv_meta):
             try:
                 all_stats.extend(libv_meta.export(
-                    stats, instance, metadata=metadata[instance], prefix='virtfs_'))
-                sleep(10)
+                    stats, instance, metadata=meta, prefix='virtfs_'))
             except Exception:
                 pass
+            # Publish partial results so scrapes see fresh domains
+            # without waiting for the whole scan
+            cc.update_stats(list(all_stats))
     except Exception:
         libv_meta.status = 1  # error
 
-    cc.ALL_STATS = all_stats
+    cc.update_stats(all_stats)
 
 
 def main(args):
@@ -225,8 +381,12 @@ def main(args):
     scheduler.log(
         'Exposing metrics at: http://{}:{}/metrics'.format(args.addr, args.port))
 
-    # Every day at 5am
-    periodic_delay = {'hours': 2, 'minutes': randrange(120)}
+    # Every day, 2h after midnight plus a deterministic per-host
+    # spread over 2h so a fleet does not scan at once and each host
+    # keeps the same slot across restarts
+    jitter = int(hashlib.blake2b(
+        socket.gethostname().encode(), digest_size=2).hexdigest(), 16) % 120
+    periodic_delay = {'hours': 2, 'minutes': jitter}
     scheduler.add_periodic_task(
         stats_disks, 'day', periodic_delay=periodic_delay, run_now=args.run_now, args=(libv_meta, cc)
     )
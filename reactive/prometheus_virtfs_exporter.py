@@ -1,5 +1,7 @@
 #!/usr/bin/env python3
 
+import functools
+
 from charmhelpers.core import hookenv
 from charmhelpers.core.hookenv import application_version_set
 from charmhelpers.core.hookenv import log
@@ -30,17 +32,30 @@ def set_version():
     set_flag('prometheus-virtfs-exporter.version')
 
 
+@functools.lru_cache(maxsize=1)
+def _extra_vars():
+    """Playbook variables, computed once per hook execution."""
+    return dict(
+        exp_port=config.get('port'),
+        exp_host=get_ip()[0],
+    )
+
+
+def run_playbook(tags=None):
+    """Apply the exporter playbook with the shared extra vars."""
+    apply_playbook(
+        playbook='ansible/playbook.yaml',
+        tags=tags,
+        extra_vars=_extra_vars(),
+    )
+
+
 @when('nova-compute.joined')
 @when_not('prometheus-virtfs-exporter.installed')
 def install_deps():
     status_set('maintenance', 'installing dependencies')
     install_ansible_support()
-    apply_playbook(
-        playbook='ansible/playbook.yaml',
-        extra_vars=dict(
-            exp_port=config.get('port'),
-            exp_host=get_ip()[0],
-        ))
+    run_playbook()
     status_set('active', 'ready')
     set_flag('prometheus-virtfs-exporter.installed')
 
@@ -48,50 +63,34 @@ def install_deps():
 # Hooks
 @hook('stop')
 def stop():
-    apply_playbook(
-        playbook='ansible/playbook.yaml',
-        tags=['uninstall'],
-        extra_vars=dict(
-            exp_port=config.get('port'),
-            exp_host=get_ip()[0],
-        ))
+    run_playbook(tags=['uninstall'])
 
 
 @hook('start')
 def start():
     install_ansible_support()
-    apply_playbook(
-        playbook='ansible/playbook.yaml',
-        tags=['install'],
-        extra_vars=dict(
-            exp_port=config.get('port'),
-            exp_host=get_ip()[0],
-        ))
+    run_playbook(tags=['install'])
     status_set('active', 'ready')
 
 
 @hook('upgrade-charm')
 def upgrade_charm():
     clear_flag('prometheus-virtfs-exporter.version')
-    apply_playbook(
-        playbook='ansible/playbook.yaml',
-        extra_vars=dict(
-            exp_port=config.get('port'),
-            exp_host=get_ip()[0],
-        ))
+    run_playbook()
     status_set('active', 'ready')
 
 
+@hook('config-changed')
+def config_changed():
+    # Port or host may have changed, recompute cached values on next use
+    get_ip.cache_clear()
+    _extra_vars.cache_clear()
+
+
 @hook('update-status')
 def update_status():
     try:
-        apply_playbook(
-            playbook='ansible/playbook.yaml',
-            tags=['start'],
-            extra_vars=dict(
-                exp_port=config.get('port'),
-                exp_host=get_ip()[0],
-            ))
+        run_playbook(tags=['start'])
     except Exception:
         log('Exporter service failed to start. Need libvirt-bin service.')
         status_set('active', 'Service failed to start')
@@ -133,8 +132,14 @@ def register_prometheus_jobs():
         })
 
 
+@functools.lru_cache(maxsize=1)
 def get_ip():
-    """Get internal IP and relation IP"""
+    """Get internal IP and relation IP
+
+    Cached for the hook execution since unit_private_ip() is a
+    hook-tool subprocess round-trip and the address is stable
+    within a hook.
+    """
     rel_ip = None
     main_ip = unit_private_ip() if not config.get('host') or (
         config.get('host') == "none") else config.get('host')